@@ -1,10 +1,22 @@
 import os
+import sys
 import time
 import random
 import json
+import sqlite3
+import threading
+import cProfile
+import multiprocessing
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 
 from flask import Flask, request, session, redirect, url_for, render_template, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from jinja2.utils import htmlsafe_json_dumps
 from werkzeug.utils import secure_filename
 
 ##################################
@@ -42,6 +54,134 @@ class ScoreEvent(db.Model):
 with app.app_context():
     db.create_all()
 
+# -------------------------------------------------------
+# ПРОФИЛИРОВАНИЕ ЗАПРОСОВ
+# -------------------------------------------------------
+# Включается переменной окружения LIGHTEMUP_PROFILE=1. Когда выключено,
+# middleware не ставится, а profile_section/profiled сводятся к одной проверке флага.
+PROFILING_ENABLED=os.environ.get("LIGHTEMUP_PROFILE","")=="1"
+PROFILE_DIR=os.environ.get("LIGHTEMUP_PROFILE_DIR","profiles")
+PROFILE_SAMPLE_RATE=float(os.environ.get("LIGHTEMUP_PROFILE_SAMPLE","0"))
+PROFILE_HEADER="HTTP_X_PROFILE"
+LATENCY_BUCKETS_MS=(5,10,25,50,100,250,500,1000,2500,5000,10000)
+
+_profile_local=threading.local()
+
+@contextmanager
+def profile_section(name):
+    """Добавляет время блока к секции name текущего запроса (db, generation, render, session)."""
+    sections=getattr(_profile_local,"sections",None) if PROFILING_ENABLED else None
+    if sections is None:
+        yield
+        return
+    t0=time.perf_counter()
+    try:
+        yield
+    finally:
+        sections[name]=sections.get(name,0.0)+time.perf_counter()-t0
+
+def profiled(name):
+    def deco(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILING_ENABLED:
+                return func(*args, **kwargs)
+            with profile_section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return deco
+
+class _ProfiledBody:
+    """Тело ответа без буферизации (стриминг, send_file); замер завершается в close()."""
+    def __init__(self, app_iter, finish):
+        self.app_iter=app_iter
+        self.finish=finish
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter,"close"):
+                self.app_iter.close()
+        finally:
+            self.finish()
+
+class ProfilingMiddleware:
+    """
+    WSGI-middleware: гистограммы задержек по маршрутам, разбивка времени
+    по секциям, cProfile по заголовку X-Profile или с вероятностью sample_rate
+    (дампы .prof в profile_dir) и список самых медленных недавних запросов.
+    """
+    def __init__(self, wsgi_app, profile_dir=PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, recent=500):
+        self.wsgi_app=wsgi_app
+        self.profile_dir=profile_dir
+        self.sample_rate=sample_rate
+        self.lock=threading.Lock()
+        self.routes={}
+        self.recent=deque(maxlen=recent)
+
+    def __call__(self, environ, start_response):
+        route=f"{environ.get('REQUEST_METHOD','GET')} {environ.get('PATH_INFO','/')}"
+        # по заголовку профилируем только запросы с localhost, как и /admin/profiling
+        local=environ.get('REMOTE_ADDR') in ("127.0.0.1","::1")
+        capture=(local and bool(environ.get(PROFILE_HEADER))) or (self.sample_rate>0 and random.random()<self.sample_rate)
+        prof=cProfile.Profile() if capture else None
+        sections={}
+        _profile_local.sections=sections
+        t0=time.perf_counter()
+        done=[]
+
+        def finish():
+            # запрос считается завершённым, когда сервер закрыл тело ответа
+            if done:
+                return
+            done.append(True)
+            if prof: prof.disable()
+            elapsed=time.perf_counter()-t0
+            _profile_local.sections=None
+            dump=self._dump(prof, route, elapsed) if prof else None
+            self._record(route, elapsed, sections, dump)
+
+        try:
+            if prof: prof.enable()
+            app_iter=self.wsgi_app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+        return _ProfiledBody(app_iter, finish)
+
+    def _dump(self, prof, route, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name=route.replace(" ","_").replace("/","_").strip("_") or "root"
+        fname=os.path.join(self.profile_dir, f"{int(time.time()*1000)}_{name}_{int(elapsed*1000)}ms.prof")
+        prof.dump_stats(fname)
+        return fname
+
+    def _record(self, route, elapsed, sections, dump):
+        ms=elapsed*1000
+        with self.lock:
+            st=self.routes.get(route)
+            if st is None:
+                st=self.routes[route]={"count":0,"total_ms":0.0,"max_ms":0.0,
+                                       "buckets":[0]*(len(LATENCY_BUCKETS_MS)+1),"sections_ms":{}}
+            st["count"]+=1
+            st["total_ms"]+=ms
+            st["max_ms"]=max(st["max_ms"],ms)
+            st["buckets"][bisect_left(LATENCY_BUCKETS_MS,ms)]+=1
+            for k,v in sections.items():
+                st["sections_ms"][k]=st["sections_ms"].get(k,0.0)+v*1000
+            self.recent.append({"route":route,"ms":round(ms,2),"timestamp":time.time(),
+                                "sections_ms":{k:round(v*1000,2) for k,v in sections.items()},
+                                "profile":dump})
+
+    def snapshot(self, top=20):
+        with self.lock:
+            routes={r:dict(st,buckets=dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS]+["inf"],st["buckets"])))
+                    for r,st in self.routes.items()}
+            slowest=sorted(self.recent,key=lambda e:e["ms"],reverse=True)[:top]
+        return {"routes":routes,"slowest":slowest}
+
 # -------------------------------------------------------
 # ОПОВЕЩЕНИЯ
 # -------------------------------------------------------
@@ -73,28 +213,27 @@ def update_leaderboard_if_needed(user_obj, new_score):
     return False
 
 # -------------------------------------------------------
-# ПАЗЛ: BLOCK, PUZZLE
+# ПАЗЛ: PUZZLE
 # -------------------------------------------------------
-class Block:
-    def __init__(self, block_type, orientation=0):
-        self.block_type = block_type
-        self.orientation = orientation
-
-    def rotate(self):
-        self.orientation = (self.orientation + 1) % 4
-
-    def to_dict(self):
-        return {"type": self.block_type, "orientation": self.orientation}
-
+# Пазл хранится в двух байтовых массивах (тип блока и ориентация, индекс y*size+x);
+# объекты на каждую клетку не создаются, JSON собирается напрямую из массивов.
 class Puzzle:
-    def __init__(self, size, blocks):
+    __slots__=("size","types","orientations")
+
+    def __init__(self, size, types=None, orientations=None):
+        n = size*size
         self.size = size
-        self.blocks = blocks
+        self.types = types if types is not None else bytearray(b'V'*n)
+        self.orientations = orientations if orientations is not None else bytearray(n)
 
     def to_json_data(self):
+        size = self.size
+        types = self.types.decode('ascii')
+        ori = self.orientations
         return {
-            "size": self.size,
-            "blocks": [[b.to_dict() for b in row] for row in self.blocks]
+            "size": size,
+            "blocks": [[{"type": types[i], "orientation": ori[i]}
+                        for i in range(y*size, (y+1)*size)] for y in range(size)]
         }
 
 # -------------------------------------------------------
@@ -142,15 +281,134 @@ def generate_snail_path(size):
             left+=1
     return path
 
+# -------------------------------------------------------
+# КЭШ ШАБЛОНОВ И СИММЕТРИИ
+# -------------------------------------------------------
+# Базовые пути хранятся по размеру как array('H') номеров клеток (y*size+x).
+# Вариант пути = одно из 8 преобразований квадрата (повороты и отражения)
+# + возможный разворот пути. Разворот не меняет поле, но меняет сам путь.
+HARD_TEMPLATE_BASES=4
+_hard_bases={}
+_hard_base_keys={}  # size -> канонические ключи баз (чтобы не хранить одну базу дважды)
+
+def path_to_ids(path, size):
+    return array('H',(y*size+x for (y,x) in path))
+
+@lru_cache(maxsize=None)
+def _dihedral_maps(size):
+    s=size-1
+    transforms=(lambda y,x:(y,x),   lambda y,x:(x,s-y),
+                lambda y,x:(s-y,s-x), lambda y,x:(s-x,y),
+                lambda y,x:(y,s-x),   lambda y,x:(x,y),
+                lambda y,x:(s-y,x),   lambda y,x:(s-x,s-y))
+    cells=[divmod(c,size) for c in range(size*size)]
+    return tuple(array('H',(ty*size+tx for (ty,tx) in (t(y,x) for (y,x) in cells))) for t in transforms)
+
+def variant_path(ids, size, k=0, reverse=False):
+    m=_dihedral_maps(size)[k]
+    seq=reversed(ids) if reverse else ids
+    return [divmod(m[c],size) for c in seq]
+
+def random_variant(ids, size):
+    return variant_path(ids,size,random.randrange(8),random.random()<0.5)
+
+def canonical_path_key(ids, size):
+    # минимальный по байтам из 16 вариантов: совпадает у путей, переходящих друг в друга
+    return min(array('H',(m[c] for c in seq)).tobytes()
+               for m in _dihedral_maps(size) for seq in (ids,ids[::-1]))
+
+@lru_cache(maxsize=None)
+def _template_ids(kind, size):
+    if kind=='easy':
+        return path_to_ids(generate_easy_snake_path(size),size)
+    return path_to_ids(generate_snail_path(size),size)
+
+@lru_cache(maxsize=None)
+def _snake_keys(size):
+    # начало пути (size+1 клеток) -> (k, reverse) для всех вариантов змейки (в том числе column snake);
+    # начало однозначно определяет вариант, так что проверка - один поиск в dict
+    ids=_template_ids('easy',size)
+    return {tuple(variant_path(ids,size,k,r)[:size+1]):(k,r) for k in range(8) for r in (False,True)}
+
 # -------------------------------------------------------
 # ПРОВЕРКА "ОБЫЧНОЙ" ЗМЕЙКИ
 # -------------------------------------------------------
 def is_basic_snake(path, size):
-    if path==generate_easy_snake_path(size):
-        return True
-    if path==generate_column_snake_path(size):
-        return True
-    return False
+    kr=_snake_keys(size).get(tuple(path[:size+1]))
+    if kr is None:
+        return False
+    return list(path)==variant_path(_template_ids('easy',size),size,*kr)
+
+def hard_template_path(size):
+    """
+    Первые HARD_TEMPLATE_BASES путей каждого размера генерируются честно и
+    запоминаются (повторы с точностью до симметрии пропускаются), дальше
+    выдаётся случайный вариант одного из них.
+    """
+    bases=_hard_bases.setdefault(size,[])
+    if len(bases)>=HARD_TEMPLATE_BASES:
+        return random_variant(random.choice(bases),size)
+    path=generate_hard_path(size)
+    if is_chain_path(path,size) and not is_basic_snake(path,size):
+        ids=path_to_ids(path,size)
+        keys=_hard_base_keys.setdefault(size,set())
+        key=canonical_path_key(ids,size)
+        if key not in keys:
+            keys.add(key)
+            bases.append(ids)
+    return path
+
+# -------------------------------------------------------
+# ОЦЕНКА СЛОЖНОСТИ (hardness)
+# -------------------------------------------------------
+# Сложность считается по "маске углов" поля: 1 - угловой блок, 0 - прямой.
+# Маску можно получить и из пути, и из готового пазла (тип блока не меняется
+# при перемешивании), поэтому оцениваются и старые записи puzzles.json.
+HARDNESS_BANDS=5
+
+def corner_mask_from_path(path, size):
+    mask=bytearray(size*size)
+    for (a,b,c) in zip(path,path[1:],path[2:]):
+        if a[0]!=c[0] and a[1]!=c[1]:
+            mask[b[0]*size+b[1]]=1
+    return bytes(mask)
+
+def corner_mask_from_blocks(blocks):
+    return bytes(1 if b["type"]=='C' else 0 for row in blocks for b in row)
+
+@lru_cache(maxsize=None)
+def _template_corner_ints(size):
+    # все повороты/отражения snake и snail (column snake - поворот snake)
+    return tuple({int.from_bytes(corner_mask_from_path(variant_path(_template_ids(kind,size),size,k),size),'big')
+                  for kind in ('easy','medium') for k in range(8)})
+
+def puzzle_hardness(mask, size):
+    """
+    Оценка сложности в [0,1] по маске углов:
+      - плотность поворотов (доля угловых блоков),
+      - длина самого длинного прямого участка (по строкам и столбцам),
+      - расстояние Хэмминга до шаблонов snake / column snake / snail.
+    Все проходы - по bytes целиком (split, xor + bit_count), без циклов по клеткам.
+    """
+    n=size*size
+    turn_density=sum(mask)/n
+    longest=1
+    for i in range(size):
+        row=mask[i*size:(i+1)*size]
+        col=mask[i::size]
+        longest=max(longest,
+                    max(map(len,row.split(b'\x01'))),
+                    max(map(len,col.split(b'\x01'))))
+    straightness=1-(longest-1)/max(1,size-1)
+    m=int.from_bytes(mask,'big')
+    template_dist=min((m^t).bit_count() for t in _template_corner_ints(size))/n
+    score=(0.4*min(1.0,turn_density/0.6)
+           +0.2*straightness
+           +0.4*min(1.0,template_dist*2))
+    return round(score,3)
+
+def hardness_band(score):
+    return min(HARDNESS_BANDS-1,int(score*HARDNESS_BANDS))
 
 # -------------------------------------------------------
 # ФУНКЦИИ ДЛЯ ОБРАБОТКИ ПУТЕЙ
@@ -209,54 +467,245 @@ def local_improve_path(path, size, iterations=15):
     return best
 
 # -------------------------------------------------------
-# 1) Maze-based
+# Дедлайны генераторов (кооперативная отмена)
 # -------------------------------------------------------
-def generate_path_maze_based(size):
-    print(f"[MazeBased] size={size}, без ограничений по времени. (DFS-лабиринт)")
-    # Генерируем лабиринт + Backtracking поиск пути
-    visited=[[False]*size for _ in range(size)]
-    edges={}
-    for y in range(size):
-        for x in range(size):
-            edges[(y,x)]=[]
-    def maze_dfs(cy,cx):
-        visited[cy][cx]=True
-        dirs=[(-1,0),(1,0),(0,-1),(0,1)]
-        random.shuffle(dirs)
-        for (dy,dx) in dirs:
-            ny,nx=cy+dy,cx+dx
-            if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                edges[(cy,cx)].append((ny,nx))
-                edges[(ny,nx)].append((cy,cx))
-                maze_dfs(ny,nx)
-    # Рандомный старт для генерации лабиринта
-    sy,sx=random.randint(0,size-1), random.randint(0,size-1)
-    maze_dfs(sy,sx)
+class GenerationTimeout(Exception):
+    pass
 
-    path=[]
-    visited2=set()
-    total=size*size
+def _check_deadline(deadline):
+    # deadline - момент по time.monotonic(); None - без ограничения
+    if deadline is not None and time.monotonic()>deadline:
+        raise GenerationTimeout()
+
+# -------------------------------------------------------
+# Общее ядро сетки для всех генераторов
+# -------------------------------------------------------
+# Клетка - целое id = y*size+x. Для каждого размера один раз строятся:
+#   adj    - соседи кортежами в порядке U,D,L,R (без выходящих за край),
+#   deg0   - степень клетки, color - (y+x)&1.
+# Состояние "посещено" - bytearray(n), степени непосещённых - список deg.
+class Grid:
+    __slots__=("size","n","adj","deg0","color")
+
+    def __init__(self, size):
+        n=size*size
+        adj=[]
+        for y in range(size):
+            for x in range(size):
+                c=y*size+x
+                a=[]
+                if y>0: a.append(c-size)
+                if y<size-1: a.append(c+size)
+                if x>0: a.append(c-1)
+                if x<size-1: a.append(c+1)
+                adj.append(tuple(a))
+        self.size=size
+        self.n=n
+        self.adj=tuple(adj)
+        self.deg0=bytes(len(a) for a in self.adj)
+        self.color=bytes((y+x)&1 for y in range(size) for x in range(size))
+
+    def to_coords(self, ids):
+        size=self.size
+        return [divmod(c,size) for c in ids]
+
+@lru_cache(maxsize=None)
+def get_grid(size):
+    return Grid(size)
+
+def random_path_start(grid, rng=random):
+    # на поле с нечётным числом клеток путь начинается и кончается на клетке
+    # большего цвета (цвет (0,0)); с другой старт отсекается сразу по чётности
+    while True:
+        s=rng.randrange(grid.n)
+        if grid.n%2==0 or grid.color[s]==grid.color[0]:
+            return s
+
+def start_deadline(deadline, starts_left):
+    """Дедлайн одного старта: равная доля оставшегося общего времени."""
+    if deadline is None:
+        return None
+    now=time.monotonic()
+    return now+max(0.0,deadline-now)/starts_left
+
+def backbite_path(ids, grid, moves, rng=random, deadline=None):
+    """
+    Случайные backbite-ходы по гамильтонову пути (список id): конец пути
+    соединяется со случайным соседом u, хвост за u разворачивается - путь
+    остаётся гамильтоновым, но перемешивается. Ход - O(n) операций в C
+    (path.index и срез). По deadline просто прекращаем перемешивание
+    (путь в любой момент корректен).
+    """
+    path=list(ids)
+    n=len(path)
+    adj=grid.adj
+    for step in range(moves):
+        if (step&255)==0 and deadline is not None and time.monotonic()>deadline:
+            break
+        if rng.random()<0.5:
+            path.reverse()  # ходим то с одного, то с другого конца
+        i=path.index(rng.choice(adj[path[-1]]))
+        if i<n-2:
+            path[i+1:]=path[:i:-1]
+    return path
 
-    def unify_dfs(cy,cx):
-        visited2.add((cy,cx))
-        path.append((cy,cx))
-        if len(path)==total:
+def hamiltonian_backtrack(adj, n, start, rng, deadline=None, warnsdorff=False, color=None):
+    """
+    Итеративный бэктрекинг гамильтонова пути из start по графу adj (id -> соседи).
+    warnsdorff=True - соседи перебираются по возрастанию степени (равные - случайно),
+    иначе просто случайно.
+    color (цвет клетки 0/1 для двудольного графа, например Grid.color) включает
+    проверку чётности. Отсечения после каждого хода в u (prev - предыдущая голова):
+      - непосещённая клетка без непосещённых соседей, не смежная с головой -> тупик;
+      - клеток степени 1, не смежных с головой (обязательных концов), больше одной -> тупик;
+      - соседи u в непосещённой области оказались в разных компонентах -> тупик;
+      - чётность: оставшиеся клетки должны чередоваться по цвету от головы,
+        обязательный конец - нужного цвета.
+    Возвращает список id или None.
+    """
+    visited=bytearray(n)
+    deg=[len(a) for a in adj]
+    left=[0,0]  # непосещённые клетки по цветам
+    if color is not None:
+        for c in range(n):
+            left[color[c]]+=1
+
+    def visit(c):
+        visited[c]=1
+        if color is not None:
+            left[color[c]]-=1
+        for u in adj[c]:
+            deg[u]-=1
+
+    def unvisit(c):
+        visited[c]=0
+        if color is not None:
+            left[color[c]]+=1
+        for u in adj[c]:
+            deg[u]+=1
+
+    def candidates(c):
+        cand=[u for u in adj[c] if not visited[u]]
+        rng.shuffle(cand)
+        if warnsdorff:
+            cand.sort(key=deg.__getitem__,reverse=True)  # pop() берёт минимальную степень
+        return cand
+
+    def connected(u, remaining):
+        # все непосещённые соседи u должны лежать в одной компоненте непосещённой области
+        nbs=[w for w in adj[u] if not visited[w]]
+        if len(nbs)<2:
             return True
-        nbr=edges[(cy,cx)]
-        random.shuffle(nbr)
-        for (ny,nx) in nbr:
-            if (ny,nx) not in visited2:
-                if unify_dfs(ny,nx):
-                    return True
-        visited2.remove((cy,cx))
-        path.pop()
+        need=set(nbs[1:])
+        seen={nbs[0]}
+        queue=[nbs[0]]
+        while queue:
+            c=queue.pop()
+            for w in adj[c]:
+                if not visited[w] and w not in seen:
+                    if w in need:
+                        need.discard(w)
+                        if not need:
+                            return True
+                    seen.add(w)
+                    queue.append(w)
         return False
 
+    def prune(prev, u, old_end):
+        """Возвращает (ok, обязательный конец или -1) после хода prev -> u."""
+        remaining=n-len(path)
+        head_nbs=adj[u]
+        for w in head_nbs:
+            if not visited[w] and deg[w]==0 and remaining>1:
+                return False, -1
+        end=-1
+        check=list(adj[prev]) if prev>=0 else []
+        if old_end>=0:
+            check.append(old_end)
+        for w in check:
+            if visited[w] or w in head_nbs or w==end:
+                continue
+            if deg[w]==0:
+                return False, -1
+            if deg[w]==1:
+                if end>=0:
+                    return False, -1
+                end=w
+        if color is not None:
+            other=left[1-color[u]]
+            same=left[color[u]]
+            if not (other==same or other==same+1):
+                return False, -1
+            if end>=0 and color[end]!=(color[u] if remaining%2==0 else 1-color[u]):
+                return False, -1
+        if not connected(u, remaining):
+            return False, -1
+        return True, end
+
+    path=[start]
+    visit(start)
+    if n==1:
+        return path
+    ok,end=prune(-1,start,-1)
+    if not ok:
+        return None
+    stack=[(candidates(start),end)]
+    steps=0
+    while stack:
+        steps+=1
+        if (steps&255)==0:
+            _check_deadline(deadline)
+        (cand,end)=stack[-1]
+        if cand:
+            u=cand.pop()
+            if visited[u]:
+                continue
+            prev=path[-1]
+            visit(u)
+            path.append(u)
+            if len(path)==n:
+                return path
+            ok,new_end=prune(prev,u,end)
+            if not ok:
+                unvisit(path.pop())
+                continue
+            stack.append((candidates(u),new_end))
+        else:
+            stack.pop()
+            unvisit(path.pop())
+    return None
+
+# -------------------------------------------------------
+# 1) Maze-based
+# -------------------------------------------------------
+def generate_path_maze_based(size, deadline=None):
+    print(f"[MazeBased] size={size}. (DFS-лабиринт)")
+    # Генерируем лабиринт (итеративный DFS) + Backtracking поиск пути по нему
+    grid=get_grid(size)
+    adj=grid.adj
+    n=grid.n
+    maze=[[] for _ in range(n)]
+    visited=bytearray(n)
+    # Рандомный старт для генерации лабиринта
+    s=random.randrange(n)
+    visited[s]=1
+    stack=[s]
+    while stack:
+        c=stack[-1]
+        opts=[u for u in adj[c] if not visited[u]]
+        if not opts:
+            stack.pop()
+            continue
+        u=random.choice(opts)
+        visited[u]=1
+        maze[c].append(u)
+        maze[u].append(c)
+        stack.append(u)
+
     # Запустим unify с другой случайной точки
-    sy2,sx2=random.randint(0,size-1), random.randint(0,size-1)
-    ok=unify_dfs(sy2,sx2)
-    if ok and len(path)==total:
-        path=local_improve_path(path,size,iterations=15)
+    ids=hamiltonian_backtrack(maze,n,random.randrange(n),random,deadline,color=grid.color)
+    if ids:
+        path=local_improve_path(grid.to_coords(ids),size,iterations=15)
         if is_chain_path(path,size):
             return path
     return None
@@ -267,34 +716,69 @@ def generate_path_maze_based(size):
 def is_power_of_two(n):
     return (n&(n-1))==0
 
-def hilbert_d_to_xy(n,d):
-    x=y=0
-    s=1
-    t=d
-    while s<n:
-        rx=1&(t//2)
-        ry=1&(t^rx)
-        if ry==0:
-            if rx==1:
-                x=s-1-x
-                y=s-1-y
-            x,y=y,x
-        x+=s*rx
-        y+=s*ry
-        t//=4
-        s<<=1
-    return (x,y)
-
-def generate_path_hilbert(size):
-    if not is_power_of_two(size):
-        return None
-    print(f"[Hilbert] size={size}, без лимита.")
-    total=size*size
+def _sgn(v):
+    return (v>0)-(v<0)
+
+def gilbert_path(width,height):
+    """
+    Обобщённая кривая Гильберта (gilbert) для прямоугольника width x height.
+    Итеративно (явный стек вместо рекурсии), все координаты за один проход.
+    Возвращает список (y,x).
+    """
     path=[]
-    for d in range(total):
-        (xx,yy)=hilbert_d_to_xy(size,d)
-        path.append((yy,xx))
-    path=local_improve_path(path,size,iterations=15)
+    if width>=height:
+        stack=[(0,0,width,0,0,height)]
+    else:
+        stack=[(0,0,0,height,width,0)]
+    while stack:
+        (x,y,ax,ay,bx,by)=stack.pop()
+        w=abs(ax+ay)
+        h=abs(bx+by)
+        dax,day=_sgn(ax),_sgn(ay)
+        dbx,dby=_sgn(bx),_sgn(by)
+        if h==1:
+            for _ in range(w):
+                path.append((y,x))
+                x+=dax; y+=day
+            continue
+        if w==1:
+            for _ in range(h):
+                path.append((y,x))
+                x+=dbx; y+=dby
+            continue
+        ax2,ay2=ax//2,ay//2
+        bx2,by2=bx//2,by//2
+        w2=abs(ax2+ay2)
+        h2=abs(bx2+by2)
+        if 2*w>3*h:
+            if (w2%2) and (w>2):
+                ax2,ay2=ax2+dax,ay2+day
+            # части кладём в стек в обратном порядке
+            stack.append((x+ax2,y+ay2,ax-ax2,ay-ay2,bx,by))
+            stack.append((x,y,ax2,ay2,bx,by))
+        else:
+            if (h2%2) and (h>2):
+                bx2,by2=bx2+dbx,by2+dby
+            stack.append((x+(ax-dax)+(bx2-dbx),y+(ay-day)+(by2-dby),-bx2,-by2,-(ax-ax2),-(ay-ay2)))
+            stack.append((x+bx2,y+by2,ax,ay,bx-bx2,by-by2))
+            stack.append((x,y,bx2,by2,ax2,ay2))
+    return path
+
+# Каждый backbite-ход стоит O(n) (поиск и разворот хвоста в C), поэтому число
+# ходов ограничено константой: перемешивание линейно по числу клеток.
+HILBERT_BACKBITE_MAX_MOVES=1000
+
+def generate_path_hilbert(size, deadline=None):
+    # gilbert детерминирован - берём случайную симметрию кривой и перемешиваем
+    # её backbite-ходами, иначе все сложные поля одного размера совпадали бы
+    print(f"[Hilbert] size={size}, gilbert (любой размер) + backbite.")
+    path=gilbert_path(size,size)
+    if not is_chain_path(path,size):
+        return None
+    grid=get_grid(size)
+    ids=path_to_ids(random_variant(path_to_ids(path,size),size),size)
+    ids=backbite_path(ids,grid,min(grid.n,HILBERT_BACKBITE_MAX_MOVES),random,deadline)
+    path=grid.to_coords(ids)  # local_improve_path не нужен: backbite уже перемешал путь
     if is_chain_path(path,size):
         return path
     return None
@@ -302,7 +786,7 @@ def generate_path_hilbert(size):
 # -------------------------------------------------------
 # 3) Sierpinski
 # -------------------------------------------------------
-def generate_path_sierpinski(size):
+def generate_path_sierpinski(size, deadline=None):
     if not is_power_of_two(size):
         return None
     print(f"[Sierpinski] size={size}.")
@@ -319,6 +803,7 @@ def generate_path_sierpinski(size):
             for (rr,cc) in cur:
                 path.append((y0+rr,x0+cc))
             return
+        _check_deadline(deadline)
         half=s//2
         sierpinski_curve(y0+half,x0,half,(orient+1)%4)
         sierpinski_curve(y0,x0,half,orient)
@@ -334,231 +819,247 @@ def generate_path_sierpinski(size):
 # -------------------------------------------------------
 # 4) Улучшенный Warnsdorff
 # -------------------------------------------------------
-def generate_path_warnsdorff_improved(size, start_attempts=8, local_backtrack_depth=3):
-    print(f"[Warnsdorff+] size={size}, attempts={start_attempts}, no time limit.")
+# Флаги отмены попыток Warnsdorff - по одному на вызов (ячейка call_id % WARNSDORFF_CANCEL_SLOTS
+# общего массива). Завершившийся вызов поднимает только свой флаг, его попытки
+# прекращают работу (кооперативная отмена), попытки других вызовов не трогаются.
+_warnsdorff_cancel=None
+_warnsdorff_pool=None
+_warnsdorff_calls=0
+_warnsdorff_lock=threading.Lock()  # вызовы идут из потоков запросов и подготовки турнира
+WARNSDORFF_WORKERS=min(8, os.cpu_count() or 1)
+WARNSDORFF_CANCEL_SLOTS=1024
+# Warnsdorff тяготеет к обходу вдоль стен (почти спираль) - такие пути
+# для "hard" не годятся, их отбрасываем по puzzle_hardness
+WARNSDORFF_MIN_HARDNESS=0.2
+
+def _warnsdorff_worker_init(cancel_value):
+    global _warnsdorff_cancel
+    _warnsdorff_cancel=cancel_value
+
+def _get_warnsdorff_pool():
+    # вызывается под _warnsdorff_lock
+    global _warnsdorff_pool, _warnsdorff_cancel
+    if _warnsdorff_pool is None:
+        # forkserver: пул создаётся лениво из потока запроса, а fork из
+        # многопоточного процесса унаследовал бы чужие захваченные блокировки
+        ctx=multiprocessing.get_context("forkserver")
+        _warnsdorff_cancel=ctx.Array('b',WARNSDORFF_CANCEL_SLOTS,lock=False)
+        _warnsdorff_pool=ProcessPoolExecutor(max_workers=WARNSDORFF_WORKERS,
+                                             mp_context=ctx,
+                                             initializer=_warnsdorff_worker_init,
+                                             initargs=(_warnsdorff_cancel,))
+    return _warnsdorff_pool
+
+def warnsdorff_attempt(size, seed, local_backtrack_depth=3, call_id=0, deadline=None):
+    """
+    Одна попытка Warnsdorff: ход в соседа с минимальной степенью,
+    при равенстве - с минимальной суммой степеней его соседей (просмотр на ход
+    вперёд), далее случайно через random.Random(seed) (детерминированно).
+    Степени непосещённых соседей хранятся в массиве deg и обновляются за O(1) на ход.
+    """
+    rng=random.Random(seed)
+    grid=get_grid(size)
+    nbrs=grid.adj
+    total=grid.n
+    deg=list(grid.deg0)
+    visited=bytearray(total)
+
+    def visit(c):
+        visited[c]=1
+        for u in nbrs[c]:
+            deg[u]-=1
+
+    def unvisit(c):
+        visited[c]=0
+        for u in nbrs[c]:
+            deg[u]+=1
+
+    start=rng.randrange(total)
+    path=[start]
+    visit(start)
+    backtracks=0
+    steps=0
+    while len(path)<total:
+        steps+=1
+        if (steps&1023)==0:
+            if call_id>0 and _warnsdorff_cancel is not None and _warnsdorff_cancel[call_id%WARNSDORFF_CANCEL_SLOTS]:
+                return None
+            if deadline is not None and time.monotonic()>deadline:
+                return None
+        c=path[-1]
+        best=None
+        eq=[]
+        for u in nbrs[c]:
+            if visited[u]:
+                continue
+            sc=deg[u]*16
+            for w in nbrs[u]:
+                if not visited[w]:
+                    sc+=deg[w]
+            if best is None or sc<best:
+                best=sc
+                eq=[u]
+            elif sc==best:
+                eq.append(u)
+        if not eq:
+            # лок откат
+            backtracks+=1
+            if backtracks>total or len(path)<=local_backtrack_depth:
+                return None
+            for _ in range(local_backtrack_depth):
+                unvisit(path.pop())
+            continue
+        t=eq[0] if len(eq)==1 else rng.choice(eq)
+        visit(t)
+        path.append(t)
+    return grid.to_coords(path)
+
+def generate_path_warnsdorff_improved(size, start_attempts=8, local_backtrack_depth=3, seed=None, deadline=None):
+    """
+    Multi-start Warnsdorff: попытки запускаются параллельно в пуле процессов,
+    возвращается первый валидный путь, остальные попытки отменяются
+    (в том числе по deadline).
+    """
+    global _warnsdorff_calls
+    print(f"[Warnsdorff+] size={size}, attempts={start_attempts}, parallel.")
     total=size*size
-    def count_unvisited_neighbors(y,x, visited):
-        c=0
-        for (dy,dx) in [(-1,0),(1,0),(0,-1),(0,1)]:
-            ny,nx=y+dy,x+dx
-            if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                c+=1
-        return c
-    def cell_score(y,x, visited):
-        # 2-ходовый look-ahead
-        sc=count_unvisited_neighbors(y,x, visited)
-        min2=999999
-        for (dy,dx) in [(-1,0),(1,0),(0,-1),(0,1)]:
-            ny,nx=y+dy,x+dx
-            if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                c2=count_unvisited_neighbors(ny,nx,visited)
-                if c2<min2: min2=c2
-        if min2==999999:
-            min2=0
-        return sc+min2
-    def local_backtrack(path, visited, steps):
-        for _ in range(steps):
-            if not path:
-                break
-            (py,px)=path.pop()
-            visited[py][px]=False
-    def single_attempt(sy,sx):
-        visited=[[False]*size for _ in range(size)]
-        path=[(sy,sx)]
-        visited[sy][sx]=True
-        while len(path)<total:
-            (cy,cx)=path[-1]
-            candidates=[]
-            for (dy,dx) in [(-1,0),(1,0),(0,-1),(0,1)]:
-                ny,nx=cy+dy,cx+dx
-                if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                    sc=cell_score(ny,nx,visited)
-                    candidates.append((sc,ny,nx))
-            if not candidates:
-                # лок откат
-                for depth in range(1,local_backtrack_depth+1):
-                    if len(path)<=depth:
-                        return None
-                    local_backtrack(path,visited,depth)
-                if len(path)<total:
-                    # попробуем продолжить, но если path не растёт, скорее всего None
-                    if len(path)==0:
-                        return None
-            else:
-                candidates.sort(key=lambda x:x[0])
-                best=candidates[0][0]
-                eq=[c for c in candidates if c[0]==best]
-                (_, ty, tx)=random.choice(eq)
-                visited[ty][tx]=True
-                path.append((ty,tx))
-        return path
+    if seed is None:
+        seed=random.randrange(1<<30)
+    seeds=[seed+i for i in range(start_attempts)]
 
-    for attempt_i in range(1,start_attempts+1):
-        sy,sx=random.randint(0,size-1), random.randint(0,size-1)
-        p=single_attempt(sy,sx)
+    def accept(p):
         if p and len(p)==total:
             p=local_improve_path(p,size,iterations=15)
-            if is_chain_path(p,size):
+            if is_chain_path(p,size) and \
+               puzzle_hardness(corner_mask_from_path(p,size),size)>=WARNSDORFF_MIN_HARDNESS:
                 return p
-    return None
+        return None
+
+    try:
+        with _warnsdorff_lock:
+            pool=_get_warnsdorff_pool()
+            _warnsdorff_calls+=1
+            call_id=_warnsdorff_calls
+            slot=call_id%WARNSDORFF_CANCEL_SLOTS
+            _warnsdorff_cancel[slot]=0
+        futures=[pool.submit(warnsdorff_attempt,size,s,local_backtrack_depth,call_id,deadline) for s in seeds]
+    except (OSError, RuntimeError) as e:
+        print(f"[Warnsdorff+] пул процессов недоступен ({e}), попытки последовательно.")
+        for s in seeds:
+            _check_deadline(deadline)
+            p=accept(warnsdorff_attempt(size,s,local_backtrack_depth,deadline=deadline))
+            if p:
+                return p
+        return None
+
+    result=None
+    try:
+        timeout=None if deadline is None else max(0.0,deadline-time.monotonic())
+        for f in as_completed(futures,timeout=timeout):
+            try:
+                p=f.result()
+            except Exception as e:
+                print(f"[Warnsdorff+] ошибка попытки: {e}")
+                continue
+            result=accept(p)
+            if result:
+                break
+    except FuturesTimeout:
+        raise GenerationTimeout()
+    finally:
+        _warnsdorff_cancel[slot]=1
+        for f in futures:
+            f.cancel()
+    return result
 
 # -------------------------------------------------------
 # 5) Backtracking DFS (удалён fallback easy snake)
 # -------------------------------------------------------
-def generate_path_backtracking_dfs(size, max_attempts=10):
+def generate_path_backtracking_dfs(size, max_attempts=10, deadline=None):
     """
-    Полный бэктрекинг без строгого time_limit (или очень большой limit).
+    Полный бэктрекинг со случайных стартов (Warnsdorff + отсечения
+    hamiltonian_backtrack); ограничен только deadline (если задан).
     """
     print(f"[BacktrackingDFS] size={size}, max_attempts={max_attempts}, no fallback snake.")
-    total=size*size
-
-    def single_try():
-        visited=[[False]*size for _ in range(size)]
-        path=[]
-        sy,sx=random.randint(0,size-1), random.randint(0,size-1)
-
-        def neighbors(y,x):
-            dirs=[(-1,0),(1,0),(0,-1),(0,1)]
-            random.shuffle(dirs)
-            for (dy,dx) in dirs:
-                ny,nx=y+dy,x+dx
-                if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                    yield (ny,nx)
-
-        def backtrack(cy,cx):
-            visited[cy][cx]=True
-            path.append((cy,cx))
-            if len(path)==total:
-                return True
-            for (ny,nx) in neighbors(cy,cx):
-                if not visited[ny][nx]:
-                    if backtrack(ny,nx):
-                        return True
-            visited[cy][cx]=False
-            path.pop()
-            return False
-
-        if backtrack(sy,sx):
-            return path
-        return None
-
+    grid=get_grid(size)
     for attempt_i in range(1,max_attempts+1):
-        p=single_try()
-        if p and len(p)==total:
-            p=local_improve_path(p,size,iterations=15)
+        try:
+            ids=hamiltonian_backtrack(grid.adj,grid.n,random_path_start(grid),random,
+                                      start_deadline(deadline,max_attempts-attempt_i+1),
+                                      warnsdorff=True,color=grid.color)
+        except GenerationTimeout:
+            _check_deadline(deadline)  # застрял только этот старт - пробуем следующий
+            continue
+        if ids:
+            p=local_improve_path(grid.to_coords(ids),size,iterations=15)
             if is_chain_path(p,size):
                 return p
     return None
 
 # -------------------------------------------------------
-# 6) Forceful BFS (для полей <=20)
+# 6) Forceful BFS
 # -------------------------------------------------------
-def generate_path_forceful_bfs(size):
+def generate_path_forceful_bfs(size, deadline=None):
     """
-    Полная BFS/DFS поиска гамильтонова пути,
-    без таймлимита, но с жёсткими эвристиками,
-    чтобы не «висеть» бесконечно.
+    Полная BFS/DFS поиска гамильтонова пути с жёсткими эвристиками;
+    ограничена только deadline (если задан).
     """
     print(f"[ForcefulBFS] size={size}. Полный поиск гамильтонова пути.")
-    if size>20:
-        return None  # не применяем на больших
-
-    total=size*size
-    visited=[[False]*size for _ in range(size)]
-    path=[]
-
-    # Сортируем соседей по количеству ещё не посещённых соседей (Warnsdorff-like).
-    def neighbors(y,x):
-        nbr=[]
-        for (dy,dx) in [(-1,0),(1,0),(0,-1),(0,1)]:
-            ny,nx=y+dy,x+dx
-            if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                # счёт
-                c=0
-                for (dy2,dx2) in [(-1,0),(1,0),(0,-1),(0,1)]:
-                    my,mx=ny+dy2,nx+dx2
-                    if 0<=my<size and 0<=mx<size and not visited[my][mx]:
-                        c+=1
-                nbr.append((c,ny,nx))
-        nbr.sort(key=lambda x:x[0])  # Warnsdorff
-        return [(ny,nx) for (c,ny,nx) in nbr]
-
-    def backtrack(cy,cx):
-        visited[cy][cx]=True
-        path.append((cy,cx))
-        if len(path)==total:
-            return True
-        nbs=neighbors(cy,cx)
-        for (ny,nx) in nbs:
-            if not visited[ny][nx]:
-                if backtrack(ny,nx):
-                    return True
-        visited[cy][cx]=False
-        path.pop()
-        return False
-
-    # Пробуем со случайных стартовых клеток
-    start_list=[]
-    for _ in range(5):
-        sy,sx=random.randint(0,size-1), random.randint(0,size-1)
-        start_list.append((sy,sx))
-    random.shuffle(start_list)
-
-    for (sy,sx) in start_list:
-        if backtrack(sy,sx) and len(path)==total:
-            path2=local_improve_path(path[:],size,iterations=15)
+    grid=get_grid(size)
+    # Пробуем со случайных стартовых клеток, соседи по Warnsdorff;
+    # каждому старту - своя доля дедлайна
+    start_list=[random_path_start(grid) for _ in range(5)]
+    for i,s in enumerate(start_list):
+        try:
+            ids=hamiltonian_backtrack(grid.adj,grid.n,s,random,start_deadline(deadline,len(start_list)-i),
+                                      warnsdorff=True,color=grid.color)
+        except GenerationTimeout:
+            _check_deadline(deadline)
+            continue
+        if ids:
+            path2=local_improve_path(grid.to_coords(ids),size,iterations=15)
             if is_chain_path(path2,size):
                 print("[ForcefulBFS] Успех!")
                 return path2
-    print("[ForcefulBFS] Неуспех, возможно поле >20 или очень не повезло.")
+    print("[ForcefulBFS] Неуспех, все старты отсечены или не хватило времени.")
     return None
 
 # -------------------------------------------------------
 # 7) ForcefulRandom
 # -------------------------------------------------------
-def generate_path_forceful_random(size):
+def generate_path_forceful_random(size, deadline=None):
     """
     Случайный проход с локальным backtrack, 
     пока не посетим все клетки или не исчерпаем 50 попыток.
     """
     print(f"[ForcefulRandom] size={size}, попробуем упорно.")
-    total=size*size
-    visited=[[False]*size for _ in range(size)]
-    path=[]
-    sy,sx=random.randint(0,size-1), random.randint(0,size-1)
-    path.append((sy,sx))
-    visited[sy][sx]=True
-
-    def neighbors(y,x):
-        dirs=[(-1,0),(1,0),(0,-1),(0,1)]
-        random.shuffle(dirs)
-        for (dy,dx) in dirs:
-            ny,nx=y+dy,x+dx
-            if 0<=ny<size and 0<=nx<size and not visited[ny][nx]:
-                yield (ny,nx)
-
-    def local_backtrack(steps):
-        for _ in range(steps):
-            if len(path)<1: 
-                return
-            (py,px)=path.pop()
-            visited[py][px]=False
+    grid=get_grid(size)
+    adj=grid.adj
+    total=grid.n
+    visited=bytearray(total)
+    s=random.randrange(total)
+    path=[s]
+    visited[s]=1
 
     tries=0
     while len(path)<total and tries<50:
-        (cy,cx)=path[-1]
-        nbs=list(neighbors(cy,cx))
+        _check_deadline(deadline)
+        nbs=[u for u in adj[path[-1]] if not visited[u]]
         if not nbs:
             # откат
-            local_backtrack(2)
+            for _ in range(2):
+                if path:
+                    visited[path.pop()]=0
             tries+=1
+            if not path:
+                break
         else:
-            (ny,nx)=random.choice(nbs)
-            visited[ny][nx]=True
-            path.append((ny,nx))
+            u=random.choice(nbs)
+            visited[u]=1
+            path.append(u)
 
-    if len(path)==total and is_chain_path(path,size):
-        path=local_improve_path(path,size,iterations=15)
+    if len(path)==total:
+        path=local_improve_path(grid.to_coords(path),size,iterations=15)
         if is_chain_path(path,size):
             print("[ForcefulRandom] Успех!")
             return path
@@ -566,23 +1067,81 @@ def generate_path_forceful_random(size):
     return None
 
 # -------------------------------------------------------
-# Итоговый генератор "hard" (7 алгоритмов) + проверка "не snake"
+# Планировщик алгоритмов "hard" (портфель с бюджетом времени)
 # -------------------------------------------------------
-def generate_hard_path(size):
+# Порядок по умолчанию совпадает с прежним фиксированным. По истории запусков
+# (таблица algo_stats в pool.db) алгоритмы сортируются по ожидаемому времени
+# до успеха = средняя задержка / доля успехов, каждому выдаётся свой дедлайн.
+# Это упорядочивание действует только внутри двух статических групп:
+# детерминированные генераторы (randomized=False, сейчас только sierpinski)
+# всегда идут после случайных, какой бы ни была их статистика: при успехе они
+# давали бы одинаковые поля одного размера. Сам sierpinski не быстр и не
+# надёжен - на размерах не степени двойки он сразу возвращает None, а его
+# склейка четвертей уже с 4x4 не даёт связной цепочки, так что стоит он
+# последним почти бесплатно. hilbert случаен: кривая перемешивается
+# backbite-ходами.
+HARD_PATH_TIME_BUDGET=30.0
+ALGO_MIN_BUDGET=0.5
+ALGO_BUDGET_FACTOR=3.0
+
+# (name, func(size, deadline), randomized)
+HARD_ALGORITHMS=[
+    ("maze",         lambda size,dl: generate_path_maze_based(size,dl), True),
+    ("hilbert",      lambda size,dl: generate_path_hilbert(size,dl), True),
+    ("sierpinski",   lambda size,dl: generate_path_sierpinski(size,dl), False),
+    ("warnsdorff",   lambda size,dl: generate_path_warnsdorff_improved(size,8,3,deadline=dl), True),
+    ("dfs",          lambda size,dl: generate_path_backtracking_dfs(size,10,dl), True),
+    ("forceful_bfs", lambda size,dl: generate_path_forceful_bfs(size,dl), True),
+    ("forceful_random", lambda size,dl: generate_path_forceful_random(size,dl), True),
+]
+
+def load_algo_stats(size):
+    with profile_section("db"):
+        rows=pool_connection().execute(
+            "SELECT algo,attempts,successes,total_time,success_time FROM algo_stats WHERE size=?",(size,)).fetchall()
+    return {r[0]:r[1:] for r in rows}
+
+def record_algo_run(size, algo, ok, elapsed):
+    with profile_section("db"):
+        pool_connection().execute("""INSERT INTO algo_stats(size,algo,attempts,successes,total_time,success_time)
+                        VALUES (?,?,1,?,?,?)
+                        ON CONFLICT(size,algo) DO UPDATE SET
+                            attempts=attempts+1,
+                            successes=successes+excluded.successes,
+                            total_time=total_time+excluded.total_time,
+                            success_time=success_time+excluded.success_time""",
+                     (size,algo,int(ok),elapsed,elapsed if ok else 0.0))
+
+def schedule_hard_algorithms(size, budget=HARD_PATH_TIME_BUDGET):
+    """[(name, func, time_limit)]: сначала случайные генераторы, затем детерминированные;
+    внутри группы - по ожидаемому времени до успеха."""
+    stats=load_algo_stats(size)
+    default_limit=budget/len(HARD_ALGORITHMS)
+    plan=[]
+    for (name,func,randomized) in HARD_ALGORITHMS:
+        attempts,successes,total_time,success_time=stats.get(name,(0,0,0.0,0.0))
+        # сглаживание: без истории - доля успехов 1/2, задержка = равная доля бюджета
+        rate=(successes+1)/(attempts+2)
+        latency=(total_time+default_limit)/(attempts+1)
+        if successes:
+            limit=max(ALGO_MIN_BUDGET,ALGO_BUDGET_FACTOR*success_time/successes)
+        else:
+            limit=default_limit
+        plan.append(((not randomized,latency/rate),name,func,limit))
+    plan.sort(key=lambda x:x[0])
+    return [(name,func,limit) for (_,name,func,limit) in plan]
+
+def generate_hard_path(size, budget=HARD_PATH_TIME_BUDGET):
     """
-    Порядок:
-      1) Maze-based
-      2) Hilbert (если 2^k)
-      3) Sierpinski (если 2^k)
-      4) Warnsdorff+ (8 попыток)
-      5) BacktrackingDFS (max_attempts=10, no fallback snake)
-      6) ForcefulBFS (для size <=20)
-      7) ForcefulRandom
-      Если всё -> fallback "column snake" + попытки 2-opt.
+    Портфель из 7 алгоритмов (maze, hilbert, sierpinski, warnsdorff, dfs,
+    forceful_bfs, forceful_random) в порядке schedule_hard_algorithms.
+    Каждый получает дедлайн min(свой лимит, остаток budget) и кооперативно
+    прекращает работу по нему; итоги пишутся в algo_stats.
+    Если всё -> fallback "column snake" + попытки 2-opt.
     """
 
-    def try_algo(algo_func):
-        path=algo_func()
+    def try_algo(algo_func, deadline):
+        path=algo_func(size,deadline)
         if path and len(path)==size*size:
             for _ in range(10):
                 if not is_basic_snake(path,size):
@@ -592,27 +1151,21 @@ def generate_hard_path(size):
                     return None
         return None
 
-    # 1) Maze-based
-    r=try_algo(lambda: generate_path_maze_based(size))
-    if r: return r
-    # 2) Hilbert
-    r=try_algo(lambda: generate_path_hilbert(size))
-    if r: return r
-    # 3) Sierpinski
-    r=try_algo(lambda: generate_path_sierpinski(size))
-    if r: return r
-    # 4) Warnsdorff
-    r=try_algo(lambda: generate_path_warnsdorff_improved(size,8,3))
-    if r: return r
-    # 5) Backtracking DFS
-    r=try_algo(lambda: generate_path_backtracking_dfs(size,10))
-    if r: return r
-    # 6) ForcefulBFS (small fields)
-    r=try_algo(lambda: generate_path_forceful_bfs(size))
-    if r: return r
-    # 7) ForcefulRandom
-    r=try_algo(lambda: generate_path_forceful_random(size))
-    if r: return r
+    t_end=time.monotonic()+budget
+    for (name,func,limit) in schedule_hard_algorithms(size,budget):
+        now=time.monotonic()
+        if now>=t_end:
+            print(f"[Hard] бюджет {budget}s исчерпан.")
+            break
+        deadline=min(t_end,now+limit)
+        try:
+            r=try_algo(func,deadline)
+        except GenerationTimeout:
+            print(f"[Hard] {name}: дедлайн {deadline-now:.2f}s.")
+            r=None
+        record_algo_run(size,name,r is not None,time.monotonic()-now)
+        if r:
+            return r
 
     # финальный fallback: column_snake + 2opt
     print("[Hard] Всё провалилось, fallback -> column_snake + local improvements.")
@@ -631,121 +1184,746 @@ def generate_hard_path(size):
 # Формирование Puzzle
 # -------------------------------------------------------
 def build_puzzle_from_path(path, size):
-    pos={coord:i for i,coord in enumerate(path)}
-    blocks=[[None]*size for _ in range(size)]
+    types=bytearray(size*size)
+    orientations=bytearray(size*size)
     def dir_from_to(a,b):
         (y1,x1)=a;(y2,x2)=b
         if y1==y2:
             return 'R' if x2>x1 else 'L'
         else:
             return 'D' if y2>y1 else 'U'
+    corner_ori={('U','L'):0,('L','U'):0,
+                ('U','R'):1,('R','U'):1,
+                ('R','D'):2,('D','R'):2,
+                ('D','L'):3,('L','D'):3}
     n=len(path)
-    for coord in path:
-        i=pos[coord]
+    for i,coord in enumerate(path):
         (y,x)=coord
+        c=y*size+x
         if i==0:
             d=dir_from_to(coord,path[1])
-            blocks[y][x]=Block('V' if d in ('U','D') else 'H',0)
+            types[c]=ord('V' if d in ('U','D') else 'H')
         elif i==n-1:
             d=dir_from_to(path[n-2],coord)
-            blocks[y][x]=Block('V' if d in ('U','D') else 'H',0)
+            types[c]=ord('V' if d in ('U','D') else 'H')
         else:
             d1=dir_from_to(path[i-1],coord)
             d2=dir_from_to(coord,path[i+1])
             if d1 in ('U','D') and d2 in ('U','D'):
-                blocks[y][x]=Block('V',0)
+                types[c]=ord('V')
             elif d1 in ('L','R') and d2 in ('L','R'):
-                blocks[y][x]=Block('H',0)
+                types[c]=ord('H')
             else:
-                pair=(d1,d2)
-                if pair in [('U','L'),('L','U')]:
-                    ori=0
-                elif pair in [('U','R'),('R','U')]:
-                    ori=1
-                elif pair in [('R','D'),('D','R')]:
-                    ori=2
-                elif pair in [('D','L'),('L','D')]:
-                    ori=3
-                else:
-                    ori=0
-                blocks[y][x]=Block('C',ori)
-    return Puzzle(size, blocks)
+                types[c]=ord('C')
+                orientations[c]=corner_ori.get((d1,d2),0)
+    return Puzzle(size, types, orientations)
 
 def scramble_puzzle_65(puzzle: Puzzle):
-    all_blocks=[]
-    for row in puzzle.blocks:
-        all_blocks.extend(row)
-    random.shuffle(all_blocks)
-    n=len(all_blocks)
+    ori=puzzle.orientations
+    n=len(ori)
     k=int(n*0.65)
-    for i, block in enumerate(all_blocks):
-        if i<k:
-            block.orientation=(block.orientation+1)%4
+    for i in random.sample(range(n),k):
+        ori[i]=(ori[i]+1)%4
 
 # -------------------------------------------------------
 # Генерация 1 пазла
 # -------------------------------------------------------
+@profiled("generation")
 def generate_single_puzzle_data(difficulty, size):
-    if difficulty=='easy':
-        path=generate_easy_snake_path(size)
-    elif difficulty=='medium':
-        path=generate_snail_path(size)
+    if difficulty in ('easy','medium'):
+        path=random_variant(_template_ids(difficulty,size),size)
     else:
-        path=generate_hard_path(size)
+        path=hard_template_path(size)
     puzzle=build_puzzle_from_path(path,size)
     scramble_puzzle_65(puzzle)
-    return puzzle.to_json_data()
+    p_data=puzzle.to_json_data()
+    p_data["hardness"]=puzzle_hardness(corner_mask_from_path(path,size),size)
+    return p_data
 
 # -------------------------------------------------------
 # Предварительная генерация (puzzles.json)
 # -------------------------------------------------------
-PRECOMPUTED_FILE="puzzles.json"
+PRECOMPUTED_FILE="puzzles.json"   # старый формат: один файл на весь пул
+PRECOMPUTED_DIR="puzzles"          # шарды <difficulty>_<size>.json + manifest.json
+MANIFEST_FILE=os.path.join(PRECOMPUTED_DIR,"manifest.json")
+POOL_DIFFICULTIES=["easy","medium","hard"]
+POOL_SIZES=range(10,101)
+POOL_COUNT_EACH=10
+
+def _write_json_atomic(path, data):
+    tmp=path+".tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        json.dump(data,f)
+    os.replace(tmp,path)
+
+def _load_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path,"r",encoding="utf-8") as f:
+        return json.load(f)
+
+def _shard_path(diff, size):
+    return os.path.join(PRECOMPUTED_DIR,f"{diff}_{size}.json")
+
+def _save_shard(manifest, diff, size, puzzle_list):
+    """Шард пишется сразу после генерации, затем обновляется манифест (оба атомарно)."""
+    _write_json_atomic(_shard_path(diff,size),{"difficulty":diff,"size":size,"puzzles":puzzle_list})
+    manifest["shards"][f"{diff}_{size}"]={"count":len(puzzle_list),"completed":time.time()}
+    _write_json_atomic(MANIFEST_FILE,manifest)
+
+def _migrate_legacy_pool(manifest):
+    """Раскладывает старый puzzles.json по шардам, чтобы его можно было дополнять."""
+    legacy=_load_json(PRECOMPUTED_FILE)
+    if not legacy:
+        return
+    print("Переносим", PRECOMPUTED_FILE, "в шарды", PRECOMPUTED_DIR)
+    for diff, by_size in legacy.items():
+        for size_str, arr in by_size.items():
+            _save_shard(manifest,diff,int(size_str),arr)
+
+def precompute_all_puzzles(incremental=False, count_each=POOL_COUNT_EACH):
+    """
+    Генерация пула по шардам (difficulty, size). Каждый готовый шард сразу
+    сохраняется на диск и отмечается в манифесте, поэтому прерванный запуск
+    продолжается с места остановки: готовые шарды пропускаются.
+    incremental=True - дополняет каждую корзину до count_each ещё не выданных
+    пазлов (по данным постоянного пула). Готовые шарды импортируются в пул.
+    """
+    os.makedirs(PRECOMPUTED_DIR,exist_ok=True)
+    manifest=_load_json(MANIFEST_FILE)
+    if manifest is None:
+        manifest={"shards":{}}
+        _migrate_legacy_pool(manifest)
+        _write_json_atomic(MANIFEST_FILE,manifest)
+
+    import_pool_shards(manifest)
+    free=pool_free_counts() if incremental else {}
+    plan=[]
+    for diff in POOL_DIFFICULTIES:
+        for sz in POOL_SIZES:
+            if f"{diff}_{sz}" not in manifest["shards"]:
+                plan.append((diff,sz,count_each))
+            elif incremental and free.get((diff,sz),0)<count_each:
+                plan.append((diff,sz,count_each-free.get((diff,sz),0)))
+    total_count=sum(need for (_,_,need) in plan)
+    if total_count==0:
+        print("Пул предвычисленных пазлов актуален:", PRECOMPUTED_DIR)
+        return manifest
+
+    current=0
+    print(f"Начинаем генерацию пазлов: {len(plan)} шардов, {total_count} пазлов...")
+    for (diff,sz,need) in plan:
+        shard=_load_json(_shard_path(diff,sz)) if f"{diff}_{sz}" in manifest["shards"] else None
+        puzzle_list=shard["puzzles"] if shard else []
+        for _ in range(need):
+            print(f"\n=== Генерация пазла (diff={diff}, size={sz}), общий прогресс {current}/{total_count} ===")
+            p_data=generate_single_puzzle_data(diff,sz)
+            puzzle_list.append(p_data)
+            current+=1
+            print(f"=== Завершено: {current}/{total_count} пазлов ===\n")
+        _save_shard(manifest,diff,sz,puzzle_list)
+        import_pool_shards(manifest)
+    print("Предвычисленные пазлы сохранены в", PRECOMPUTED_DIR)
+    return manifest
+
+# -------------------------------------------------------
+# Серверный решатель (проверка единственности решения)
+# -------------------------------------------------------
+# Стороны блока: U=1, R=2, D=4, L=8 (поворот по часовой - сдвиг влево на 1 бит)
+_ARM_OPP={1:4,2:8,4:1,8:2}
+_SOLVER_TYPES={'V':0,'H':1,'C':2}
+# _ARMS[тип][ориентация] -> битовая маска сторон
+_ARMS=((5,10,5,10),(10,5,10,5),(9,3,6,12))
+# Допустимые ориентации: у прямых блоков 2 и 3 совпадают с 0 и 1
+_FULL_DOMAIN=(0b0011,0b0011,0b1111)
+
+def _domain_arms():
+    any_arms=[[0]*16 for _ in range(3)]
+    all_arms=[[0]*16 for _ in range(3)]
+    for t in range(3):
+        for m in range(16):
+            a_or=0; a_and=15
+            for o in range(4):
+                if m>>o&1:
+                    a_or|=_ARMS[t][o]; a_and&=_ARMS[t][o]
+            any_arms[t][m]=a_or
+            all_arms[t][m]=a_and if m else 0
+    return any_arms, all_arms
+_ANY_ARMS,_ALL_ARMS=_domain_arms()
+_DOMAIN_ORIENTS=tuple(tuple(o for o in range(4) if m>>o&1) for m in range(16))
+_POPCOUNT=tuple(bin(m).count('1') for m in range(16))
+
+class _SolverLimit(Exception):
+    pass
+
+def solve_puzzle(p_data, max_solutions=2, max_nodes=20000):
+    """
+    Ищет ориентации блоков, при которых все клетки подсвечены, т.е. взаимные
+    связи образуют гамильтонов путь (ровно 2 "висящих" конца) или цикл.
+    Ориентации клетки - 4-битная маска, ограничения по рёбрам распространяются
+    между соседями, остаток добирается итеративным бэктрекингом. Все изменения
+    пишутся в trail и откатываются при возврате (без копий массивов).
+    Связь двух клеток фиксируется, как только обе точно смотрят друг на друга;
+    для каждого фрагмента пути хранятся его концы (partner), поэтому связь,
+    замыкающая преждевременный цикл, запрещается сразу. Концы пути ищутся
+    только на линиях, разрешённых чётностью уголков (end_scenarios), все
+    остальные клетки сразу помечаются "не конец".
+    Возвращает: solutions (найдено, не больше max_solutions), unique,
+    complete (False - упёрлись в max_nodes), min_rotations (минимум кликов
+    до решения среди найденных), solution (ориентации, плоский список).
+    """
+    size=p_data["size"]
+    n=size*size
+    types=[_SOLVER_TYPES[b["type"]] for row in p_data["blocks"] for b in row]
+    cur=[b["orientation"] for row in p_data["blocks"] for b in row]
+    # соседи по направлениям (бит стороны -> клетка или -1)
+    nbr=[]
+    for y in range(size):
+        for x in range(size):
+            nbr.append(((1,(y-1)*size+x if y>0 else -1),
+                        (2,y*size+x+1 if x<size-1 else -1),
+                        (4,(y+1)*size+x if y<size-1 else -1),
+                        (8,y*size+x-1 if x>0 else -1)))
+    dom=[_FULL_DOMAIN[t] for t in types]
+    status=bytearray(n)       # 0 - неизвестно, 1 - не конец пути, 2 - конец пути
+    linked=bytearray(n)       # стороны с зафиксированной связью
+    partner=list(range(n))    # для конца фрагмента - другой конец
+    fsize=[1]*n               # для конца фрагмента - число клеток во фрагменте
+    state=[0,0,0]             # число концов пути, цвет первого конца, число связей
+    trail=[]
+    solutions=[]
+    nodes=0
+
+    def setv(arr,i,v):
+        trail.append((arr,i,arr[i]))
+        arr[i]=v
+
+    def undo(mark):
+        while len(trail)>mark:
+            arr,i,v=trail.pop()
+            arr[i]=v
+
+    def add_end(c):
+        # чётность: в гамильтоновом пути на двудольной сетке при чётном n концы разного цвета,
+        # при нечётном - оба цвета (0,0)
+        setv(state,0,state[0]+1)
+        if state[0]>2: return False
+        color=sum(divmod(c,size))&1
+        if n&1:
+            return color==0
+        if state[0]==2:
+            return color!=state[1]
+        setv(state,1,color)
+        return True
+
+    def link(c,b,nb,queue,inq):
+        # фиксируем связь c-nb: склеиваем фрагменты или замыкаем цикл (только на всё поле)
+        setv(linked,c,linked[c]|b)
+        setv(linked,nb,linked[nb]|_ARM_OPP[b])
+        setv(state,2,state[2]+1)
+        pc=partner[c]; pn=partner[nb]
+        if pc==nb:
+            return fsize[c]==n
+        s=fsize[c]+fsize[nb]
+        setv(partner,pc,pn); setv(partner,pn,pc)
+        setv(fsize,pc,s); setv(fsize,pn,s)
+        for e in (pc,pn):
+            if not inq[e]: inq[e]=1; queue.append(e)
+        return True
+
+    def propagate(queue):
+        inq=bytearray(n)
+        for c in queue: inq[c]=1
+        while queue:
+            c=queue.pop()
+            inq[c]=0
+            m=dom[c]; t=types[c]; st=status[c]
+            # can - сосед может ответить связью, sure - точно ответит,
+            # must - "не конец" сосед точно указывает на c, значит c обязан указывать на него,
+            # forbid - сосед - другой конец нашего фрагмента: связь с ним замкнёт цикл
+            can=sure=must=forbid=0
+            end_of=partner[c] if linked[c] and _POPCOUNT[linked[c]]==1 and fsize[c]<n else -1
+            for (b,nb) in nbr[c]:
+                if nb<0: continue
+                ob=_ARM_OPP[b]; tn=types[nb]; dn=dom[nb]
+                if _ANY_ARMS[tn][dn]&ob:
+                    can|=b
+                    if _ALL_ARMS[tn][dn]&ob:
+                        sure|=b
+                        if nb==end_of and not linked[c]&b: forbid|=b
+                        elif status[nb]==1: must|=b
+            new=0; ends=True
+            for o in _DOMAIN_ORIENTS[m]:
+                a=_ARMS[t][o]
+                if must&~a or a&forbid: continue
+                bad=_POPCOUNT[a&~can]
+                if bad>1: continue
+                if bad and st==1: continue
+                if st==2 and not bad and _POPCOUNT[a&sure]==2: continue
+                new|=1<<o
+                if not bad: ends=False
+            if not new:
+                return False
+            changed=new!=m
+            if changed:
+                setv(dom,c,new)
+            if st==0 and ends:
+                setv(status,c,2); st=2
+                if not add_end(c): return False
+                changed=True
+                if state[0]==2:
+                    for i in range(n):
+                        if status[i]==0:
+                            setv(status,i,1)
+                            if not inq[i]: inq[i]=1; queue.append(i)
+            arms=_ALL_ARMS[t][new]&~linked[c]
+            if arms&sure:
+                for (b,nb) in nbr[c]:
+                    if arms&sure&b:
+                        if not link(c,b,nb,queue,inq): return False
+            if changed:
+                for (b,nb) in nbr[c]:
+                    if nb>=0 and not inq[nb]: inq[nb]=1; queue.append(nb)
+                if not inq[c]: inq[c]=1; queue.append(c)
+        return True
+
+    def choose():
+        # клетка с наименьшим числом вариантов, при равенстве - на границе решённой области
+        best=-1; bc=99
+        for c in range(n):
+            m=dom[c]
+            if m&(m-1):
+                k=2*(_POPCOUNT[m]-(status[c]==1))
+                for (_,nb) in nbr[c]:
+                    if nb>=0 and not dom[nb]&(dom[nb]-1):
+                        break
+                else:
+                    k+=1
+                if k<bc:
+                    bc=k; best=c
+                    if k<=2: break
+        return best
+
+    def branches(c):
+        if status[c]==0:
+            res=[(dom[c],1)]
+            if state[0]<2: res.append((dom[c],2))
+            return res
+        m=dom[c]
+        return [(1<<o,status[c]) for o in range(4) if m>>o&1]
+
+    def apply(c,m,st):
+        if dom[c]!=m:
+            setv(dom,c,m)
+        if status[c]!=st:
+            setv(status,c,st)
+            if st==2:
+                if not add_end(c): return False
+                if state[0]==2:
+                    for i in range(n):
+                        if status[i]==0: setv(status,i,1)
+                    return propagate(list(range(n)))
+        return propagate([c]+[nb for (_,nb) in nbr[c] if nb>=0])
+
+    def solved():
+        # всё зафиксировано: путь, если связей n-1, или цикл на всё поле
+        if state[2]>=n-1:
+            solutions.append([d.bit_length()-1 for d in dom])
+        return len(solutions)>=max_solutions
+
+    def end_scenarios():
+        # Вдоль столбца вертикальные связи соседних клеток: нижняя = верхняя XOR [уголок],
+        # у конца пути чётность меняется ровно по одной оси. Значит концы лежат на
+        # столбцах/строках с нечётным числом уголков; если таких нет - оба конца
+        # на одной линии или решение - цикл. Сценарий - клетки, где разрешён конец.
+        odd=[[y*size+x for y in range(size)] for x in range(size)
+             if sum(types[y*size+x]==2 for y in range(size))&1]
+        odd+=[list(range(y*size,(y+1)*size)) for y in range(size)
+              if sum(types[y*size+x]==2 for x in range(size))&1]
+        if len(odd)==2:
+            return [odd[0]+odd[1]]
+        if odd:
+            return []
+        return [[]]+[[y*size+x for y in range(size)] for x in range(size)] \
+                   +[list(range(y*size,(y+1)*size)) for y in range(size)]
+
+    def search():
+        nonlocal nodes
+        c=choose()
+        if c<0:
+            return solved()
+        stack=[[c,branches(c),0,len(trail)]]
+        while stack:
+            frame=stack[-1]
+            undo(frame[3])
+            if frame[2]>=len(frame[1]):
+                stack.pop()
+                continue
+            m,st=frame[1][frame[2]]
+            frame[2]+=1
+            nodes+=1
+            if nodes>max_nodes:
+                raise _SolverLimit()
+            if not apply(frame[0],m,st):
+                continue
+            c=choose()
+            if c<0:
+                if solved(): return True
+                continue
+            stack.append([c,branches(c),0,len(trail)])
+        return False
 
-def precompute_all_puzzles():
-    if os.path.exists(PRECOMPUTED_FILE):
-        with open(PRECOMPUTED_FILE,"r",encoding="utf-8") as f:
-            puzzles_data=json.load(f)
-        print("Загружены предвычисленные пазлы из", PRECOMPUTED_FILE)
-        return puzzles_data
+    complete=True
+    try:
+        for allowed in end_scenarios():
+            mark=len(trail)
+            ok=bytearray(n)
+            for c in allowed: ok[c]=1
+            for c in range(n):
+                if not ok[c]: setv(status,c,1)
+            if propagate(list(range(n))) and search():
+                break
+            undo(mark)
+    except _SolverLimit:
+        complete=False
+    def rotations(sol):
+        return sum((o-c)%(4 if t==2 else 2) for (o,c,t) in zip(sol,cur,types))
+    return {"solutions":len(solutions),"unique":complete and len(solutions)==1,
+            "complete":complete,"nodes":nodes,
+            "min_rotations":min(map(rotations,solutions)) if solutions else None,
+            "solution":min(solutions,key=rotations) if solutions else None}
+
+def _solve_pool_entry(p):
+    r=solve_puzzle(p)
+    del r["solution"]
+    return r
+
+def _pool_file_entries(data):
+    # шард: {"difficulty","size","puzzles"}; старый формат: {difficulty:{size:[...]}}
+    if "puzzles" in data:
+        return [(data["difficulty"],p) for p in data["puzzles"]]
+    return [(diff,p) for diff,by_size in data.items() for arr in by_size.values() for p in arr]
+
+def validate_pool_file(path=None, workers=None, annotate=True):
+    """
+    Прогоняет решатель по файлу пула (по умолчанию - по всем шардам) в пуле процессов.
+    Каждому пазлу дописывается поле "solver" (unique, min_rotations, complete);
+    при annotate=True файлы перезаписываются. Возвращает сводку по сложностям.
+    """
+    if path is None:
+        manifest=_load_json(MANIFEST_FILE,{"shards":{}})
+        paths=[os.path.join(PRECOMPUTED_DIR,key+".json") for key in manifest["shards"]]
     else:
-        difficulties=["easy","medium","hard"]
-        sizes=range(10,101)
-        count_each=10
-        total_count=len(difficulties)*len(sizes)*count_each
-        current=0
-        puzzles_data={"easy":{}, "medium":{}, "hard":{}}
-        print("Начинаем генерацию пазлов...")
-        for diff in difficulties:
-            for sz in sizes:
-                puzzle_list=[]
-                for _ in range(count_each):
-                    print(f"\n=== Генерация пазла (diff={diff}, size={sz}), общий прогресс {current}/{total_count} ===")
-                    p_data=generate_single_puzzle_data(diff,sz)
-                    puzzle_list.append(p_data)
-                    current+=1
-                    print(f"=== Завершено: {current}/{total_count} пазлов ===\n")
-                puzzles_data[diff][str(sz)] = puzzle_list
-        with open(PRECOMPUTED_FILE,"w",encoding="utf-8") as f:
-            json.dump(puzzles_data,f)
-        print("Предвычисленные пазлы сохранены в", PRECOMPUTED_FILE)
-        return puzzles_data
+        paths=[path]
+    summary={}
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for path in paths:
+            data=_load_json(path)
+            entries=_pool_file_entries(data)
+            print(f"[Solver] проверяем {len(entries)} пазлов из {path}")
+            puzzles=[p for (_,p) in entries]
+            for p, r in zip(puzzles, ex.map(_solve_pool_entry, puzzles, chunksize=4)):
+                p["solver"]={"unique":r["unique"],"min_rotations":r["min_rotations"],"complete":r["complete"]}
+            for (diff,p) in entries:
+                st=summary.setdefault(diff,{"total":0,"unique":0,"incomplete":0,"unsolvable":0})
+                st["total"]+=1
+                st["unique"]+=p["solver"]["unique"]
+                st["incomplete"]+=not p["solver"]["complete"]
+                st["unsolvable"]+=p["solver"]["min_rotations"] is None and p["solver"]["complete"]
+            if annotate:
+                _write_json_atomic(path,data)
+    print("[Solver] итог:", summary)
+    return summary
 
 # -------------------------------------------------------
 # Глобальный пул
 # -------------------------------------------------------
-puzzles_data={}
-
-def get_precomputed_puzzle(difficulty, size):
-    size_str=str(size)
-    if difficulty not in puzzles_data:
-        puzzles_data[difficulty]={}
-    if size_str not in puzzles_data[difficulty]:
-        puzzles_data[difficulty][size_str]=[]
-    arr=puzzles_data[difficulty][size_str]
-    if len(arr)>0:
-        return arr.pop(0)
+# Пул хранится в SQLite (pool.db): выданные пазлы помечаются state=1 и не
+# возвращаются после перезапуска. Выдача - один атомарный UPDATE ... RETURNING,
+# поэтому любое число потоков/процессов берёт пазлы из общего пула без дублей.
+POOL_DB=os.path.join(os.path.dirname(os.path.abspath(__file__)),"pool.db")
+POOL_FREE,POOL_CLAIMED=0,1
+
+# Соединения с pool.db: поток берёт соединение при первом обращении и держит его
+# до release_pool_connection() (в конце запроса), после чего оно возвращается
+# в небольшой общий список свободных. Схема создаётся один раз на файл базы.
+POOL_MAX_IDLE=8
+_pool_local=threading.local()
+_pool_lock=threading.Lock()
+_pool_idle=[]             # свободные соединения: (путь к базе, соединение)
+_pool_schema_ready=set()  # базы, для которых схема уже создана
+
+def _init_pool_schema(conn):
+    conn.execute("PRAGMA journal_mode=WAL")  # сохраняется в самом файле базы
+    conn.execute("""CREATE TABLE IF NOT EXISTS pool_puzzles(
+                        id INTEGER PRIMARY KEY,
+                        difficulty TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        band INTEGER NOT NULL,
+                        state INTEGER NOT NULL DEFAULT 0,
+                        payload TEXT NOT NULL,
+                        claimed_at REAL)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS ix_pool_claim
+                        ON pool_puzzles(difficulty,size,state,band)""")
+    # сколько пазлов каждого шарда уже импортировано (шарды только дописываются)
+    conn.execute("""CREATE TABLE IF NOT EXISTS pool_shards(
+                        shard TEXT PRIMARY KEY,
+                        imported INTEGER NOT NULL)""")
+    # пазл каждого турнирного раунда - один на все воркеры
+    conn.execute("""CREATE TABLE IF NOT EXISTS tournament_rounds(
+                        round_id INTEGER PRIMARY KEY,
+                        payload TEXT NOT NULL)""")
+    # история запусков алгоритмов "hard" для schedule_hard_algorithms
+    conn.execute("""CREATE TABLE IF NOT EXISTS algo_stats(
+                        size INTEGER NOT NULL,
+                        algo TEXT NOT NULL,
+                        attempts INTEGER NOT NULL,
+                        successes INTEGER NOT NULL,
+                        total_time REAL NOT NULL,
+                        success_time REAL NOT NULL,
+                        PRIMARY KEY(size,algo))""")
+
+def pool_connection():
+    conn=getattr(_pool_local,"conn",None)
+    if conn is not None:
+        return conn
+    path=POOL_DB
+    with _pool_lock:
+        while _pool_idle and conn is None:
+            idle_path,idle=_pool_idle.pop()
+            if idle_path==path:
+                conn=idle
+            else:
+                idle.close()
+        fresh=conn is None
+        if fresh:
+            # соединение переходит между потоками, но используется одним потоком за раз
+            conn=sqlite3.connect(path,timeout=30,isolation_level=None,check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            if path not in _pool_schema_ready:
+                _init_pool_schema(conn)
+                _pool_schema_ready.add(path)
+    _pool_local.conn=conn
+    _pool_local.path=path
+    return conn
+
+def release_pool_connection():
+    """Возвращает соединение текущего потока в общий список (или закрывает лишнее)."""
+    conn=getattr(_pool_local,"conn",None)
+    if conn is None:
+        return
+    _pool_local.conn=None
+    if conn.in_transaction:
+        conn.rollback()
+    with _pool_lock:
+        if len(_pool_idle)<POOL_MAX_IDLE:
+            _pool_idle.append((_pool_local.path,conn))
+            return
+    conn.close()
+
+def import_pool_shards(manifest=None):
+    """Импортирует в пул новые пазлы из шардов; старые записи без hardness оцениваются здесь."""
+    manifest=manifest or _load_json(MANIFEST_FILE,{"shards":{}})
+    conn=pool_connection()
+    imported=dict(conn.execute("SELECT shard,imported FROM pool_shards"))
+    added=0
+    for key, info in manifest["shards"].items():
+        done=imported.get(key,0)
+        if info["count"]<=done:
+            continue
+        shard=_load_json(os.path.join(PRECOMPUTED_DIR,key+".json"))
+        rows=[]
+        for p in shard["puzzles"][done:]:
+            if "hardness" not in p:
+                p["hardness"]=puzzle_hardness(corner_mask_from_blocks(p["blocks"]),p["size"])
+            rows.append((shard["difficulty"],shard["size"],hardness_band(p["hardness"]),json.dumps(p)))
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO pool_puzzles(difficulty,size,band,payload) VALUES (?,?,?,?)",rows)
+            conn.execute("INSERT OR REPLACE INTO pool_shards(shard,imported) VALUES (?,?)",(key,done+len(rows)))
+        added+=len(rows)
+    if added:
+        print(f"[Pool] импортировано {added} пазлов в {POOL_DB}")
+    return added
+
+def pool_free_counts():
+    """{(difficulty,size): число ещё не выданных пазлов}"""
+    with profile_section("db"):
+        rows=pool_connection().execute(
+            "SELECT difficulty,size,COUNT(*) FROM pool_puzzles WHERE state=? GROUP BY difficulty,size",(POOL_FREE,)).fetchall()
+    return {(d,s):c for (d,s,c) in rows}
+
+def claim_pool_puzzle(difficulty, size, band=None):
+    if band is None:
+        sub="SELECT id FROM pool_puzzles WHERE difficulty=? AND size=? AND state=? ORDER BY id LIMIT 1"
+        args=(difficulty,size,POOL_FREE)
     else:
-        return generate_single_puzzle_data(difficulty,size)
+        sub="SELECT id FROM pool_puzzles WHERE difficulty=? AND size=? AND state=? AND band=? ORDER BY id LIMIT 1"
+        args=(difficulty,size,POOL_FREE,band)
+    with profile_section("db"):
+        row=pool_connection().execute(
+            f"UPDATE pool_puzzles SET state=?, claimed_at=? WHERE id=({sub}) AND state=? RETURNING payload",
+            (POOL_CLAIMED,time.time())+args+(POOL_FREE,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def get_precomputed_puzzle(difficulty, size, band=None):
+    """
+    Берёт пазл из постоянного пула. Если задан band (0..HARDNESS_BANDS-1) -
+    сначала из этой корзины сложности, если она пуста - из ближайшей непустой;
+    если свободных нет вовсе - генерируем новый.
+    """
+    if band is not None and not 0<=band<HARDNESS_BANDS:
+        band=None
+    if band is None:
+        bands=[None]
+    else:
+        # генерация корзину не выбирает (лёгкие режимы почти всегда дают band 0),
+        # поэтому ближайшая корзина из пула ближе к запросу, чем новый пазл
+        bands=sorted(range(HARDNESS_BANDS),key=lambda b:(abs(b-band),b))
+    for b in bands:
+        p_data=claim_pool_puzzle(difficulty,size,b)
+        if p_data is not None:
+            return p_data
+    return generate_single_puzzle_data(difficulty,size)
+
+# -------------------------------------------------------
+# Турнир: один пазл на раунд для всех игроков
+# -------------------------------------------------------
+# Раунд - интервал длиной TOURNAMENT_ROUND_SECONDS, id = int(time/длина).
+# Пазл раунда берётся один раз (фоновый поток готовит следующий раунд заранее)
+# и хранится уже сериализованным в JSON, поэтому стоимость раунда не зависит
+# от числа игроков. Результаты ранжируются в памяти процесса.
+TOURNAMENT_ROUND_SECONDS=300
+TOURNAMENT_DIFFICULTY="hard"
+TOURNAMENT_SIZE=30
+TOURNAMENT_KEEP_ROUNDS=4  # сколько последних раундов держать в памяти
+TOURNAMENT_PREPARE_TIMEOUT=HARD_PATH_TIME_BUDGET+30  # сколько ждать чужую подготовку раунда
+
+class TournamentRound:
+    def __init__(self, round_id):
+        self.round_id=round_id
+        self.starts_at=round_id*TOURNAMENT_ROUND_SECONDS
+        self.ends_at=self.starts_at+TOURNAMENT_ROUND_SECONDS
+        self.size=TOURNAMENT_SIZE
+        self.puzzle_json=None
+        self.error=None
+        self.ready=threading.Event()
+        self.lock=threading.Lock()
+        self.ranking=[]   # отсортированные (время, момент сдачи, user_id)
+        self.players={}   # user_id -> ник
+
+    def submit(self, user_id, nickname, elapsed):
+        """Засчитывает первую сдачу игрока; возвращает место (с 1) или None."""
+        now=time.time()
+        if now>=self.ends_at:
+            return None
+        with self.lock:
+            if user_id in self.players:
+                return self.place(user_id)
+            self.players[user_id]=nickname
+            entry=(elapsed,now,user_id)
+            insort(self.ranking,entry)
+            return bisect_left(self.ranking,entry)+1
+
+    def place(self, user_id):
+        for i,(_,_,uid) in enumerate(self.ranking):
+            if uid==user_id:
+                return i+1
+        return None
+
+    def standings(self):
+        with self.lock:
+            return [{"place":i+1,"nickname":self.players[uid],"time":elapsed}
+                    for i,(elapsed,_,uid) in enumerate(self.ranking)]
+
+_tournament_rounds={}
+_tournament_lock=threading.Lock()
+
+def tournament_round_id(t=None):
+    return int((time.time() if t is None else t)//TOURNAMENT_ROUND_SECONDS)
+
+def _round_payload(round_id):
+    """
+    Пазл раунда из pool.db. Проверка, выдача пазла из пула и запись раунда идут
+    в одной транзакции BEGIN IMMEDIATE: воркеры, пришедшие одновременно, ждут
+    первого и читают уже записанный пазл, так что пул теряет ровно один пазл
+    на раунд. Если пул пуст, пазл генерируется вне транзакции (генерация
+    долгая, а блокировка записи держит весь pool.db) и пишется через
+    INSERT OR IGNORE - проигравший в гонке тратит только время, не пул.
+    """
+    conn=pool_connection()
+    select="SELECT payload FROM tournament_rounds WHERE round_id=?"
+    insert="INSERT OR IGNORE INTO tournament_rounds(round_id,payload) VALUES (?,?)"
+    with conn:
+        with profile_section("db"):
+            conn.execute("BEGIN IMMEDIATE")
+            row=conn.execute(select,(round_id,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        p_data=claim_pool_puzzle(TOURNAMENT_DIFFICULTY,TOURNAMENT_SIZE)  # сама пишет в секцию db
+        with profile_section("db"):
+            conn.execute("DELETE FROM tournament_rounds WHERE round_id<=?",(round_id-TOURNAMENT_KEEP_ROUNDS,))
+            if p_data is not None:
+                conn.execute(insert,(round_id,json.dumps(p_data)))
+                return p_data
+    p_data=generate_single_puzzle_data(TOURNAMENT_DIFFICULTY,TOURNAMENT_SIZE)
+    with profile_section("db"):
+        conn.execute(insert,(round_id,json.dumps(p_data)))
+        row=conn.execute(select,(round_id,)).fetchone()
+    return json.loads(row[0])
+
+def _prepare_round(rnd):
+    try:
+        p_data=_round_payload(rnd.round_id)
+        rnd.size=p_data["size"]
+        rnd.puzzle_json=str(htmlsafe_json_dumps(p_data,separators=(",",":")))
+        print(f"[Tournament] раунд {rnd.round_id} готов ({rnd.size}x{rnd.size})")
+    except Exception as e:
+        rnd.error=e
+        print(f"[Tournament] раунд {rnd.round_id}: ошибка подготовки: {e}")
+    finally:
+        rnd.ready.set()
+
+def _prepare_round_background(rnd):
+    try:
+        _prepare_round(rnd)
+    finally:
+        release_pool_connection()
+
+def _drop_round(rnd):
+    with _tournament_lock:
+        if _tournament_rounds.get(rnd.round_id) is rnd:
+            del _tournament_rounds[rnd.round_id]
+
+def get_tournament_round(round_id=None):
+    """
+    Возвращает готовый раунд или None (раунд уже прошёл или подготовить не удалось).
+    Создаются только текущий и следующий раунды. Пазл готовит первый
+    запросивший (остальные ждут его), заодно в фоне готовится следующий раунд.
+    """
+    current=tournament_round_id()
+    if round_id is None:
+        round_id=current
+    with _tournament_lock:
+        rnd=_tournament_rounds.get(round_id)
+        if rnd is None and round_id not in (current,current+1):
+            return None
+        owner=rnd is None
+        if owner:
+            rnd=_tournament_rounds[round_id]=TournamentRound(round_id)
+        nxt=None
+        if round_id==current and round_id+1 not in _tournament_rounds:
+            nxt=_tournament_rounds[round_id+1]=TournamentRound(round_id+1)
+        for old in [r for r in _tournament_rounds if r<=current-TOURNAMENT_KEEP_ROUNDS]:
+            del _tournament_rounds[old]
+    if nxt is not None:
+        threading.Thread(target=_prepare_round_background,args=(nxt,),daemon=True).start()
+    if owner:
+        _prepare_round(rnd)
+    if not rnd.ready.wait(TOURNAMENT_PREPARE_TIMEOUT) or rnd.error is not None:
+        _drop_round(rnd)  # следующий запрос попробует подготовить раунд заново
+        return None
+    return rnd
 
 # -------------------------------------------------------
 # Flask-маршруты
@@ -753,6 +1931,10 @@ def get_precomputed_puzzle(difficulty, size):
 app = Flask(__name__)
 app.secret_key = "some_secret_for_sessions"
 
+@app.teardown_request
+def _release_pool(exc):
+    release_pool_connection()
+
 @app.route("/")
 def index():
     if 'user_id' in session:
@@ -806,9 +1988,26 @@ def start_game():
     if size>100:
         size=100
 
+    band=request.form.get('hardness','')
+    band=int(band) if band.isdigit() else None
+
     session['mode']=mode
     session['difficulty']=difficulty
     session['size']=size
+    session['hardness']=band
+
+    if mode=="tournament":
+        rnd=get_tournament_round()
+        if rnd is None:
+            return "Ошибка: не удалось подготовить пазл раунда, попробуйте ещё раз."
+        session['tournament_round']=rnd.round_id
+        session['difficulty']=TOURNAMENT_DIFFICULTY
+        session['size']=rnd.size
+        session['start_time']=time.time()
+        session['time_limit']=max(1,int(rnd.ends_at-time.time()))
+        session['score']=0
+        session.pop('puzzle_data',None)  # пазл раунда отдаётся из общего кэша
+        return redirect(url_for('game'))
 
     if mode=="competition":
         session['start_time']=time.time()
@@ -819,7 +2018,7 @@ def start_game():
         session['time_limit']=0
         session['score']=0
 
-    p_data=get_precomputed_puzzle(difficulty,size)
+    p_data=get_precomputed_puzzle(difficulty,size,band)
     session['puzzle_data']=p_data
     return redirect(url_for('game'))
 
@@ -831,6 +2030,20 @@ def game():
     mode=session.get('mode')
     difficulty=session.get('difficulty')
     time_limit=session.get('time_limit',0)
+    if mode=="tournament":
+        round_id=session.get('tournament_round')
+        # прошедшие раунды заново не создаются; текущий раунд другого
+        # воркера берётся из pool.db (тот же пазл)
+        rnd=None
+        if round_id is not None and time.time()<(round_id+1)*TOURNAMENT_ROUND_SECONDS:
+            rnd=get_tournament_round(round_id)
+        if rnd is None:
+            return redirect(url_for('tournament_standings',round_id=round_id))
+        return render_template("game.html",
+                               puzzle_json=rnd.puzzle_json,
+                               mode=mode,
+                               difficulty=difficulty,
+                               time_limit=max(1,int(rnd.ends_at-time.time())))
     return render_template("game.html",
                            puzzle_data=puzzle_data,
                            mode=mode,
@@ -848,6 +2061,20 @@ def level_solved():
     score=session.get('score')
     size=session.get('size')
 
+    if mode=="tournament":
+        round_id=session.get('tournament_round')
+        rnd=_tournament_rounds.get(round_id)
+        if rnd is None and round_id is not None and time.time()<(round_id+1)*TOURNAMENT_ROUND_SECONDS:
+            rnd=get_tournament_round(round_id)
+        start_time=session.get('start_time')
+        if rnd is not None and start_time:
+            # время считает сервер (присланному клиентом не верим), в пределах окна раунда
+            start=min(max(start_time,rnd.starts_at),rnd.ends_at)
+            elapsed=max(0.0,min(time.time(),rnd.ends_at)-start)
+            user=User.query.get(session['user_id'])
+            rnd.submit(user.id,user.nickname,int(elapsed))
+        return jsonify({"next_url":url_for('tournament_standings',round_id=round_id)})
+
     diff_mult={'easy':1,'medium':2,'hard':3}.get(difficulty,1)
     base_points=size
     time_penalty=max(1,elapsed)
@@ -880,7 +2107,7 @@ def level_solved():
         if now-start_time>=180:
             return jsonify({"next_url":url_for('time_is_up')})
         else:
-            p_data=get_precomputed_puzzle(difficulty,size)
+            p_data=get_precomputed_puzzle(difficulty,size,session.get('hardness'))
             session['puzzle_data']=p_data
             return jsonify({"next_url":url_for('game')})
 
@@ -902,6 +2129,8 @@ def show_training_result():
 
 @app.route("/time_is_up")
 def time_is_up():
+    if session.get('mode')=='tournament':
+        return redirect(url_for('tournament_standings',round_id=session.get('tournament_round')))
     if 'user_id' not in session or session.get('mode')!='competition':
         return redirect(url_for('index'))
     score=session.get('score',0)
@@ -927,6 +2156,23 @@ def time_is_up():
 
     return render_template("time_is_up.html", score=score, position=pos)
 
+@app.route("/tournament/standings")
+def tournament_standings():
+    if 'user_id' not in session:
+        return redirect(url_for('index'))
+    round_id=request.args.get('round_id',type=int)
+    if round_id is None:
+        round_id=tournament_round_id()
+    rnd=_tournament_rounds.get(round_id)
+    rows=rnd.standings() if rnd is not None else []
+    my_place=rnd.place(session['user_id']) if rnd is not None else None
+    return render_template("tournament.html",
+                           round_id=round_id,
+                           rows=rows,
+                           my_place=my_place,
+                           finished=time.time()>=(round_id+1)*TOURNAMENT_ROUND_SECONDS,
+                           next_round_in=max(0,int((tournament_round_id()+1)*TOURNAMENT_ROUND_SECONDS-time.time())))
+
 @app.route("/profile", methods=["GET","POST"])
 def profile():
     if 'user_id' not in session:
@@ -957,11 +2203,84 @@ def poll_announcements():
         return jsonify({"has_announcement":True,"announcement":announcement})
     return jsonify({"has_announcement":False})
 
+# -------------------------------------------------------
+# Подключение профилирования
+# -------------------------------------------------------
+profiler=None
+
+def install_profiling(flask_app):
+    """Оборачивает wsgi_app и вешает таймеры на SQLAlchemy, шаблоны и cookie-сессию."""
+    global profiler
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from flask import before_render_template, template_rendered
+    from flask.sessions import SecureCookieSessionInterface
+
+    def before_cursor(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_t0",[]).append(time.perf_counter())
+
+    def after_cursor(conn, cursor, statement, parameters, context, executemany):
+        stack=conn.info.get("profile_t0")
+        if not stack:
+            return
+        t0=stack.pop()
+        sections=getattr(_profile_local,"sections",None)
+        if sections is not None:
+            sections["db"]=sections.get("db",0.0)+time.perf_counter()-t0
+
+    def cursor_error(exception_context):
+        # при ошибке запроса after_cursor_execute не вызывается - снимаем метку здесь
+        conn=exception_context.connection
+        stack=conn.info.get("profile_t0") if conn is not None else None
+        if stack:
+            stack.pop()
+
+    def render_started(sender, template, context, **extra):
+        _profile_local.render_t0=time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        sections=getattr(_profile_local,"sections",None)
+        t0=getattr(_profile_local,"render_t0",None)
+        if sections is not None and t0 is not None:
+            sections["render"]=sections.get("render",0.0)+time.perf_counter()-t0
+
+    class ProfiledSessionInterface(SecureCookieSessionInterface):
+        def open_session(self, app, request):
+            with profile_section("session"):
+                return super().open_session(app, request)
+
+        def save_session(self, app, session, response):
+            with profile_section("session"):
+                return super().save_session(app, session, response)
+
+    event.listen(Engine,"before_cursor_execute",before_cursor)
+    event.listen(Engine,"after_cursor_execute",after_cursor)
+    event.listen(Engine,"handle_error",cursor_error)
+    before_render_template.connect(render_started, flask_app, weak=False)
+    template_rendered.connect(render_finished, flask_app, weak=False)
+    flask_app.session_interface=ProfiledSessionInterface()
+    profiler=ProfilingMiddleware(flask_app.wsgi_app)
+    flask_app.wsgi_app=profiler
+    print(f"[Profiling] включено, дампы cProfile -> {PROFILE_DIR}, sample_rate={PROFILE_SAMPLE_RATE}")
+
+@app.route("/admin/profiling")
+def admin_profiling():
+    # доступно только при включённом профилировании и только с localhost
+    if profiler is None or request.remote_addr not in ("127.0.0.1","::1"):
+        return "Not found", 404
+    return jsonify(profiler.snapshot(request.args.get("top",20,type=int)))
+
+if PROFILING_ENABLED:
+    install_profiling(app)
+
 # -------------------------------------------------------
 # MAIN
 # -------------------------------------------------------
 if __name__=="__main__":
-    puzzles_data=precompute_all_puzzles()
+    if "--validate" in sys.argv:
+        validate_pool_file()
+        sys.exit(0)
+    precompute_all_puzzles(incremental="--incremental" in sys.argv)
     app.run(host="0.0.0.0", port=221, debug=True)
 
 